@@ -3,14 +3,19 @@ import json
 import os
 import requests
 from datetime import datetime
+from functools import partial
+
+from hedging import Deadline, hedged_call, parse_models
 
 class ContentGenerator:
     def __init__(self):
         self.api_key = os.getenv('SILICONFLOW_API_KEY')
         self.base_url = "https://api.siliconflow.cn/v1/chat/completions"
         self.model = os.getenv('SILICONFLOW_MODEL', 'Qwen/Qwen2.5-72B-Instruct')
+        # 主模型失败或过慢时依次使用的备用模型
+        self.fallback_models = parse_models(os.getenv('SILICONFLOW_FALLBACK_MODELS'))
 
-    def search_and_generate(self, topic: str) -> dict:
+    def search_and_generate(self, topic: str, deadline: Deadline = None) -> dict:
         """基于主题生成文案"""
         prompt = f"""基于以下主题生成小红书风格的文案：
 
@@ -32,28 +37,12 @@ class ContentGenerator:
     "image_keywords": ["关键词1", "关键词2"]
 }}"""
 
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-
-        payload = {
-            "model": self.model,
-            "messages": [{"role": "user", "content": prompt}],
-            "max_tokens": 2000,
-            "temperature": 0.7
-        }
-
+        models = [self.model] + [m for m in self.fallback_models if m != self.model]
+        attempts = [(m, partial(self._request_completion, m, prompt)) for m in models]
         # DeepSeek-R1 是推理模型，需要更长的超时时间
-        response = requests.post(self.base_url, headers=headers, json=payload, timeout=180)
-        response.raise_for_status()
-
-        result = response.json()
-        content_text = result['choices'][0]['message']['content']
-        
-        # DeepSeek-R1 可能返回 reasoning_content，我们只需要最终答案
-        if 'reasoning_content' in result['choices'][0]['message']:
-            print("  (推理完成，提取最终答案...)")
+        _, content_text = hedged_call(attempts, cap=180, default_delay=90, deadline=deadline)
+        if content_text is None:
+            raise RuntimeError("文案生成失败：模型未返回内容")
 
         try:
             start_idx = content_text.find('{')
@@ -77,12 +66,43 @@ class ContentGenerator:
 
         return result
 
-    def save_draft(self, content: dict, output_path: str):
-        """保存草稿到JSON文件"""
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(content, f, ensure_ascii=False, indent=2)
-        print(f"草稿已保存到：{output_path}")
+    def _request_completion(self, model: str, prompt: str, session: requests.Session, timeout: float) -> str:
+        """调用一次对话接口，返回文本内容"""
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+        payload = {
+            "model": model,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": 2000,
+            "temperature": 0.7
+        }
+
+        response = session.post(self.base_url, headers=headers, json=payload, timeout=timeout)
+        response.raise_for_status()
+
+        result = response.json()
+        message = result['choices'][0]['message']
+
+        # DeepSeek-R1 可能返回 reasoning_content，我们只需要最终答案
+        if 'reasoning_content' in message:
+            print("  (推理完成，提取最终答案...)")
+
+        return message['content'] or None
+
+    def save_draft(self, content: dict) -> str:
+        """保存只有文案的草稿到 DraftStore，返回草稿ID（图片在发布时补充）"""
+        from draft_store import DraftStore
+
+        store = DraftStore()
+        try:
+            draft_id = store.create(content, [])
+        finally:
+            store.close()
+        print(f"草稿已保存：{draft_id}")
+        return draft_id
 
 
 if __name__ == "__main__":
@@ -93,5 +113,6 @@ if __name__ == "__main__":
 
     print(json.dumps(result, ensure_ascii=False, indent=2))
 
-    output_path = f"../output/draft_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-    generator.save_draft(result, output_path)
+    draft_id = generator.save_draft(result)
+    print(f"查看完整草稿: python draft_store.py {draft_id}")
+    print(f"补充图片后发布: python xhs_playwright.py {draft_id} ../images/xxx.jpg ...")
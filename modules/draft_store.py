@@ -0,0 +1,330 @@
+"""草稿存储模块 - 使用SQLite保存草稿及其图片清单"""
+import hashlib
+import json
+import os
+import sqlite3
+import struct
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+DEFAULT_DB_PATH = Path(__file__).parent.parent / "output" / "drafts.db"
+
+# 草稿状态：待发布 / 已发布 / 发布失败
+STATUS_PENDING = "pending"
+STATUS_PUBLISHED = "published"
+STATUS_FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS drafts (
+    id TEXT PRIMARY KEY,
+    topic TEXT,
+    title TEXT NOT NULL,
+    content TEXT NOT NULL,
+    tags TEXT NOT NULL,
+    image_keywords TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_drafts_status ON drafts(status, created_at);
+CREATE INDEX IF NOT EXISTS idx_drafts_created ON drafts(created_at);
+
+CREATE TABLE IF NOT EXISTS draft_images (
+    draft_id TEXT NOT NULL REFERENCES drafts(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    sha256 TEXT,
+    size_bytes INTEGER,
+    width INTEGER,
+    height INTEGER,
+    source TEXT,
+    model TEXT,
+    keyword TEXT,
+    PRIMARY KEY (draft_id, position)
+);
+CREATE INDEX IF NOT EXISTS idx_draft_images_path ON draft_images(path);
+"""
+
+
+def new_draft_id() -> str:
+    """生成草稿ID"""
+    return f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+
+
+def image_dimensions(path: str) -> Optional[tuple]:
+    """读取PNG/JPEG图片尺寸（只解析文件头，不依赖图像库）"""
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(26)
+            if head[:8] == b'\x89PNG\r\n\x1a\n':
+                width, height = struct.unpack('>II', head[16:24])
+                return width, height
+            if head[:2] != b'\xff\xd8':
+                return None
+            # JPEG：逐段查找SOF标记
+            f.seek(2)
+            while True:
+                marker = f.read(2)
+                if len(marker) < 2 or marker[0] != 0xFF:
+                    return None
+                code = marker[1]
+                if code in (0xD8, 0x01) or 0xD0 <= code <= 0xD7:
+                    continue
+                length = struct.unpack('>H', f.read(2))[0]
+                if code in (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+                            0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF):
+                    height, width = struct.unpack('>xHH', f.read(5))
+                    return width, height
+                f.seek(length - 2, os.SEEK_CUR)
+    except (OSError, struct.error):
+        return None
+
+
+def file_sha256(path: str) -> Optional[str]:
+    """计算文件SHA256"""
+    try:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    except OSError:
+        return None
+
+
+def verify_images(images: List[dict]) -> List[str]:
+    """
+    校验图片清单与磁盘文件是否一致
+
+    Args:
+        images: get_images() 返回的清单
+
+    Returns:
+        问题列表，为空表示全部一致
+    """
+    problems = []
+    for img in images:
+        path = img['path']
+        try:
+            size_bytes = os.path.getsize(path)
+        except OSError:
+            problems.append(f"图片不存在: {path}")
+            continue
+        if img['size_bytes'] is not None and size_bytes != img['size_bytes']:
+            problems.append(f"图片大小不一致: {path}")
+        elif img['sha256'] and file_sha256(path) != img['sha256']:
+            problems.append(f"图片校验和不一致: {path}")
+    return problems
+
+
+def _image_rows(draft_id: str, images: List[str], image_meta: Dict[str, dict] = None,
+                start: int = 0) -> List[tuple]:
+    """生成图片清单记录：路径、校验和、大小、尺寸和生成信息"""
+    image_meta = image_meta or {}
+    rows = []
+    for position, img in enumerate(images, start):
+        path = str(Path(img).resolve())
+        meta = image_meta.get(img, {})
+        size = image_dimensions(path) or (None, None)
+        try:
+            size_bytes = os.path.getsize(path)
+        except OSError:
+            size_bytes = None
+        rows.append((
+            draft_id, position, path, file_sha256(path), size_bytes,
+            size[0], size[1], meta.get('source'), meta.get('model'), meta.get('keyword')
+        ))
+    return rows
+
+
+def format_draft(draft: dict) -> str:
+    """格式化完整草稿（标题、正文、标签、图片），用于手动复制发布"""
+    lines = [
+        f"草稿ID: {draft['id']}  状态: {draft['status']}",
+        "",
+        f"标题: {draft['title']}",
+        "",
+        draft['content'],
+        "",
+        f"标签: {' '.join('#' + t for t in draft['tags'])}",
+    ]
+    images = draft.get('images', [])
+    lines.append(f"图片: {len(images)} 张")
+    lines.extend(f"  {img['path']}" for img in images)
+    return "\n".join(lines)
+
+
+class DraftStore:
+    """草稿包存储：每个草稿记录自己的图片路径、校验和、尺寸和生成信息"""
+
+    def __init__(self, db_path: str = None):
+        self.db_path = str(db_path or DEFAULT_DB_PATH)
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        # WAL 模式允许多个进程同时读写
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        """关闭数据库连接"""
+        self.conn.close()
+
+    def create(self, content: dict, images: List[str], image_meta: Dict[str, dict] = None,
+               draft_id: str = None) -> str:
+        """
+        保存草稿及其图片清单
+
+        Args:
+            content: ContentGenerator 生成的文案
+            images: 图片路径列表（按发布顺序）
+            image_meta: 图片路径 -> 生成信息（source/model/keyword）
+            draft_id: 预先分配的草稿ID（可选，默认自动生成）
+
+        Returns:
+            草稿ID
+        """
+        now = datetime.now().isoformat()
+        draft_id = draft_id or new_draft_id()
+        rows = _image_rows(draft_id, images, image_meta)
+
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO drafts (id, topic, title, content, tags, image_keywords, status, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    draft_id,
+                    content.get('original_topic'),
+                    content.get('title', ''),
+                    content.get('content', ''),
+                    json.dumps(content.get('tags', []), ensure_ascii=False),
+                    json.dumps(content.get('image_keywords', []), ensure_ascii=False),
+                    STATUS_PENDING,
+                    content.get('created_at', now),
+                    now,
+                )
+            )
+            self.conn.executemany(
+                "INSERT INTO draft_images (draft_id, position, path, sha256, size_bytes, width, height, source, model, keyword)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+        return draft_id
+
+    def add_images(self, draft_id: str, images: List[str], image_meta: Dict[str, dict] = None):
+        """
+        给已有草稿追加图片（例如只生成了文案的草稿），追加的图片排在已有图片之后
+
+        Args:
+            draft_id: 草稿ID
+            images: 图片路径列表（按发布顺序）
+            image_meta: 图片路径 -> 生成信息（source/model/keyword）
+        """
+        start = len(self.get_images(draft_id))
+        rows = _image_rows(draft_id, images, image_meta, start)
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO draft_images (draft_id, position, path, sha256, size_bytes, width, height, source, model, keyword)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self.conn.execute(
+                "UPDATE drafts SET updated_at = ? WHERE id = ?",
+                (datetime.now().isoformat(), draft_id)
+            )
+
+    def import_json(self, draft_path: str, images: List[str] = None) -> str:
+        """导入旧版JSON草稿，images 为该草稿要发布的图片（不再使用整个图片文件夹）"""
+        with open(draft_path, 'r', encoding='utf-8') as f:
+            content = json.load(f)
+        return self.create(content, images or [])
+
+    def get(self, draft_id: str) -> Optional[dict]:
+        """按ID加载草稿（包含图片清单）"""
+        row = self.conn.execute("SELECT * FROM drafts WHERE id = ?", (draft_id,)).fetchone()
+        if row is None:
+            return None
+        draft = self._row_to_draft(row)
+        draft['images'] = self.get_images(draft_id)
+        return draft
+
+    def get_images(self, draft_id: str) -> List[dict]:
+        """获取草稿关联的图片清单（按发布顺序）"""
+        rows = self.conn.execute(
+            "SELECT * FROM draft_images WHERE draft_id = ? ORDER BY position", (draft_id,)
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    def list(self, status: str = None, limit: int = 50, offset: int = 0) -> List[dict]:
+        """分页列出草稿（不含图片清单），按创建时间倒序"""
+        if status:
+            rows = self.conn.execute(
+                "SELECT * FROM drafts WHERE status = ? ORDER BY created_at DESC LIMIT ? OFFSET ?",
+                (status, limit, offset)
+            ).fetchall()
+        else:
+            rows = self.conn.execute(
+                "SELECT * FROM drafts ORDER BY created_at DESC LIMIT ? OFFSET ?",
+                (limit, offset)
+            ).fetchall()
+        return [self._row_to_draft(r) for r in rows]
+
+    def set_status(self, draft_id: str, status: str):
+        """更新草稿状态"""
+        with self.conn:
+            self.conn.execute(
+                "UPDATE drafts SET status = ?, updated_at = ? WHERE id = ?",
+                (status, datetime.now().isoformat(), draft_id)
+            )
+
+    def pinned_paths(self, failed_max_age_days: float = None) -> set:
+        """
+        返回清理时需要保留的图片路径
+
+        待发布草稿的图片始终保留；发布失败的草稿只在 failed_max_age_days 天内保留，
+        为 None 时一直保留
+        """
+        sql = ("SELECT DISTINCT i.path FROM draft_images i JOIN drafts d ON d.id = i.draft_id"
+               " WHERE d.status = ?")
+        params = [STATUS_PENDING]
+        if failed_max_age_days is None:
+            sql += " OR d.status = ?"
+            params.append(STATUS_FAILED)
+        else:
+            cutoff = datetime.now() - timedelta(days=failed_max_age_days)
+            sql += " OR (d.status = ? AND d.updated_at >= ?)"
+            params += [STATUS_FAILED, cutoff.isoformat()]
+        rows = self.conn.execute(sql, params).fetchall()
+        return {r['path'] for r in rows}
+
+    @staticmethod
+    def _row_to_draft(row: sqlite3.Row) -> dict:
+        draft = dict(row)
+        draft['tags'] = json.loads(draft['tags'])
+        draft['image_keywords'] = json.loads(draft['image_keywords'])
+        draft['original_topic'] = draft.pop('topic')
+        return draft
+
+
+if __name__ == "__main__":
+    import sys
+
+    store = DraftStore()
+    if len(sys.argv) > 1:
+        # python draft_store.py <draft_id>：打印完整草稿
+        draft = store.get(sys.argv[1])
+        if draft is None:
+            print(f"❌ 草稿不存在: {sys.argv[1]}")
+            store.close()
+            sys.exit(1)
+        print(format_draft(draft))
+    else:
+        drafts = store.list(limit=20)
+        print(f"最近 {len(drafts)} 个草稿：")
+        for d in drafts:
+            print(f"  [{d['status']}] {d['id']}  {d['title']}")
+        print("\n查看完整草稿: python draft_store.py <草稿ID>")
+    store.close()
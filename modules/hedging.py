@@ -0,0 +1,317 @@
+"""对冲请求模块 - 慢请求自动向备用模型发起对冲，控制长尾延迟"""
+import json
+import os
+import queue
+import socket
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+DEFAULT_LATENCY_FILE = Path(__file__).parent.parent / "output" / "latency.json"
+
+
+class DeadlineExceeded(TimeoutError):
+    """超出单篇笔记的截止时间"""
+
+
+class Deadline:
+    """单篇笔记的截止时间，在各个阶段之间传递"""
+
+    def __init__(self, seconds: float = None):
+        self.expires_at = time.monotonic() + seconds if seconds is not None else None
+        self._paused_remaining: Optional[float] = None
+
+    @classmethod
+    def from_env(cls) -> "Deadline":
+        """读取 XHS_NOTE_DEADLINE（秒），未配置或为 0 时不限时"""
+        value = os.getenv('XHS_NOTE_DEADLINE', '').strip()
+        if not value:
+            return cls()
+        try:
+            seconds = float(value)
+        except ValueError:
+            raise ValueError(f"XHS_NOTE_DEADLINE 必须是秒数（0 表示不限时），当前为: {value}") from None
+        if seconds < 0:
+            raise ValueError(f"XHS_NOTE_DEADLINE 不能为负数，当前为: {value}")
+        return cls(seconds or None)
+
+    def pause(self):
+        """暂停计时（例如等待用户输入时），之后调用 resume() 继续"""
+        self._paused_remaining = self.remaining()
+
+    def resume(self):
+        """从 pause() 时的剩余时间继续计时"""
+        if self._paused_remaining is not None:
+            self.expires_at = time.monotonic() + self._paused_remaining
+
+    def remaining(self) -> Optional[float]:
+        """剩余秒数，不限时返回 None"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def timeout(self, cap: float) -> float:
+        """取 cap 与剩余时间的较小者，已超时则抛出 DeadlineExceeded"""
+        remaining = self.remaining()
+        if remaining is None:
+            return cap
+        if remaining <= 0:
+            raise DeadlineExceeded("已超出单篇笔记截止时间")
+        return min(cap, remaining)
+
+
+class _ConnectionTracker:
+    """记录一个 Session 建立的连接，取消时关闭其中仍在传输的 socket"""
+
+    def __init__(self):
+        self.cancelled = False
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def register(self, conn):
+        with self._lock:
+            if self.cancelled:
+                conn.close()
+                # 由 requests 包装为 ConnectionError
+                raise ConnectionAbortedError("请求已取消")
+            self._connections.append(conn)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            sock = getattr(conn, "sock", None)
+            if sock is None:
+                continue
+            try:
+                # shutdown 会让另一个线程中阻塞的 recv 立即返回，close 做不到
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class _CancellableAdapter(HTTPAdapter):
+    """连接池使用可追踪的连接类，以便取消进行中的请求"""
+
+    def __init__(self, tracker: _ConnectionTracker, **kwargs):
+        self.tracker = tracker
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self._track(self.poolmanager)
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+        # proxy_manager_for 会缓存管理器，只替换一次
+        if not proxy.lower().startswith("socks") and not getattr(manager, "_tracked", False):
+            self._track(manager)
+        return manager
+
+    def _track(self, manager):
+        tracker = self.tracker
+
+        def tracked(conn_base, pool_base):
+            def connect(conn):
+                conn_base.connect(conn)
+                tracker.register(conn)
+
+            conn_cls = type(f"Tracked{conn_base.__name__}", (conn_base,), {"connect": connect})
+            return type(f"Tracked{pool_base.__name__}", (pool_base,), {"ConnectionCls": conn_cls})
+
+        manager.pool_classes_by_scheme = {
+            "http": tracked(HTTPConnection, HTTPConnectionPool),
+            "https": tracked(HTTPSConnection, HTTPSConnectionPool),
+        }
+        manager._tracked = True
+
+
+class CancellableSession(requests.Session):
+    """可以从其他线程取消的 Session：cancel() 断开所有进行中的连接，之后的请求直接失败"""
+
+    def __init__(self):
+        super().__init__()
+        self._tracker = _ConnectionTracker()
+        for prefix in ("http://", "https://"):
+            self.mount(prefix, _CancellableAdapter(self._tracker))
+
+    def cancel(self):
+        self._tracker.cancel()
+        self.close()
+
+
+class LatencyTracker:
+    """按模型记录最近的请求耗时，用于学习 p95 对冲阈值"""
+
+    def __init__(self, window: int = 50, min_samples: int = 5, path: str = None):
+        self.window = window
+        self.min_samples = min_samples
+        self.path = Path(path or DEFAULT_LATENCY_FILE)
+        self._samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            for model, samples in data.items():
+                self._samples[model] = deque(samples[-self.window:], maxlen=self.window)
+        except (OSError, ValueError):
+            pass
+
+    def save(self):
+        """保存耗时样本，下次运行继续使用"""
+        with self._lock:
+            data = {model: list(samples) for model, samples in self._samples.items()}
+        try:
+            os.makedirs(self.path.parent, exist_ok=True)
+            tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"⚠️  保存耗时统计失败: {e}")
+
+    def record(self, model: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(model, deque(maxlen=self.window)).append(round(seconds, 3))
+
+    def p95(self, model: str, default: float) -> float:
+        """返回该模型的 p95 耗时，样本不足时返回 default"""
+        with self._lock:
+            samples = sorted(self._samples.get(model, ()))
+        if len(samples) < self.min_samples:
+            return default
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+
+_tracker: Optional[LatencyTracker] = None
+
+
+def get_tracker() -> LatencyTracker:
+    """进程内共享的耗时统计"""
+    global _tracker
+    if _tracker is None:
+        _tracker = LatencyTracker()
+    return _tracker
+
+
+def hedging_enabled() -> bool:
+    """XHS_HEDGE=1 时启用对冲"""
+    return os.getenv('XHS_HEDGE', '0').lower() in ('1', 'true', 'yes', 'on')
+
+
+def parse_models(value: str) -> List[str]:
+    """解析逗号分隔的模型列表"""
+    return [m.strip() for m in (value or '').split(',') if m.strip()]
+
+
+def hedged_call(attempts: List[Tuple[str, Callable[[requests.Session, float], object]]], cap: float,
+                default_delay: float, deadline: Deadline = None,
+                hedge: bool = None, tracker: LatencyTracker = None) -> Tuple[str, object]:
+    """
+    按顺序调用多个模型，先返回有效结果者胜出
+
+    - 当前请求失败时立即切换到下一个模型
+    - 启用对冲时，当前请求超过该模型学到的 p95 耗时仍未返回，
+      会同时向下一个模型发起备用请求
+    - 每个请求使用独立的 CancellableSession 并在守护线程中运行；胜出或中止后取消其余请求，
+      断开仍在等待响应的连接，落败的线程随即结束，也不会阻止进程退出
+
+    Args:
+        attempts: [(模型名, fn(session, timeout) -> 结果)]，fn 失败时抛出异常或返回 None
+        cap: 单次请求的最长超时（秒）
+        default_delay: 耗时样本不足时的对冲等待时间（秒）
+        deadline: 单篇笔记截止时间
+        hedge: 是否启用对冲，默认读取 XHS_HEDGE
+        tracker: 耗时统计，默认使用进程内共享实例
+
+    Returns:
+        (胜出模型名, 结果)
+    """
+    deadline = deadline or Deadline()
+    tracker = tracker or get_tracker()
+    if hedge is None:
+        hedge = hedging_enabled()
+
+    results: queue.Queue = queue.Queue()
+    sessions: List[CancellableSession] = []
+    pending = list(attempts)
+    running: List[str] = []
+    last_error: Optional[BaseException] = None
+
+    def run(model: str, fn, session: CancellableSession):
+        try:
+            timeout = deadline.timeout(cap)
+            started = time.monotonic()
+            result = fn(session, timeout)
+            if result is not None:
+                tracker.record(model, time.monotonic() - started)
+            results.put((model, result, None))
+        except Exception as e:
+            results.put((model, None, e))
+
+    def launch():
+        model, fn = pending.pop(0)
+        session = CancellableSession()
+        sessions.append(session)
+        running.append(model)
+        threading.Thread(target=run, args=(model, fn, session),
+                         name=f"hedge-{model}", daemon=True).start()
+
+    try:
+        launch()
+        while running:
+            # 只对最新发出的请求计算对冲等待时间
+            newest = running[-1]
+            wait_for = deadline.remaining()
+            if hedge and pending:
+                delay = tracker.p95(newest, default_delay)
+                wait_for = delay if wait_for is None else min(delay, wait_for)
+
+            try:
+                model, result, error = results.get(timeout=wait_for)
+            except queue.Empty:
+                if deadline.expired():
+                    raise DeadlineExceeded("已超出单篇笔记截止时间")
+                print(f"⏱️  {newest} 超过 {wait_for:.0f}s 未返回，向 {pending[0][0]} 发起对冲请求")
+                launch()
+                continue
+
+            running.remove(model)
+            if error is not None:
+                print(f"⚠️  {model} 请求失败: {error}")
+                last_error = error
+            elif result is not None:
+                if len(attempts) > 1 and model != attempts[0][0]:
+                    print(f"↪️  由备用模型 {model} 返回结果")
+                return model, result
+            else:
+                print(f"⚠️  {model} 未返回有效结果")
+
+            if deadline.expired():
+                raise DeadlineExceeded("已超出单篇笔记截止时间")
+            # 已返回的请求失败了，切换到下一个模型
+            if pending:
+                launch()
+
+        if last_error:
+            raise last_error
+        return attempts[-1][0], None
+    finally:
+        # 取消所有请求：断开仍在传输的连接，落败的线程收到连接错误后退出，结果被丢弃
+        for session in sessions:
+            session.cancel()
+        tracker.save()
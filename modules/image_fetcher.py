@@ -3,9 +3,13 @@ import os
 import requests
 import hashlib
 import random
+import uuid
 from pathlib import Path
-from typing import List
+from typing import Dict, List
 from urllib.parse import quote
+from functools import partial
+
+from hedging import Deadline, DeadlineExceeded, hedged_call, parse_models
 
 class ImageFetcher:
     def __init__(self, output_dir: str = "../images"):
@@ -16,65 +20,60 @@ class ImageFetcher:
         self.api_url = "https://api.siliconflow.cn/v1/images/generations"
         # 文生图模型
         self.model = os.getenv('SILICONFLOW_IMAGE_MODEL', 'Kwai-Kolors/Kolors')
+        # 主模型失败或过慢时依次使用的备用模型
+        self.fallback_models = parse_models(os.getenv('SILICONFLOW_IMAGE_FALLBACK_MODELS'))
+        # 图片路径 -> 生成信息，供草稿清单记录
+        self.image_meta: Dict[str, dict] = {}
 
-    def search_and_download(self, keywords: List[str], count: int = 3) -> List[str]:
+    def search_and_download(self, keywords: List[str], count: int = 3, deadline: Deadline = None) -> List[str]:
         """根据关键词生成图片"""
         downloaded_images = []
+        deadline = deadline or Deadline()
+        # 每批图片使用唯一文件名前缀，不同草稿（包括并发的生成进程）不会互相覆盖
+        batch = uuid.uuid4().hex[:12]
 
         for i, keyword in enumerate(keywords[:count]):
+            if deadline.expired():
+                print("⚠️  已超出单篇笔记截止时间，停止生成图片")
+                break
             # 优先使用AI生成图片
-            image_path = self._generate_with_ai(keyword, i)
+            image_path = self._generate_with_ai(keyword, i, deadline, batch)
             # 备用方案
-            if not image_path:
-                image_path = self._download_from_picsum(i)
+            if not image_path and not deadline.expired():
+                image_path = self._download_from_picsum(i, batch=batch, deadline=deadline)
+                if image_path:
+                    self.image_meta[image_path] = {"source": "picsum", "model": None, "keyword": keyword}
             if image_path:
                 downloaded_images.append(image_path)
 
         return downloaded_images
 
-    def _generate_with_ai(self, keyword: str, index: int = 0) -> str:
+    def _generate_with_ai(self, keyword: str, index: int = 0, deadline: Deadline = None,
+                          batch: str = None) -> str:
         """使用硅基流动AI生成图片"""
         if not self.api_key:
             print("⚠️  未配置 SILICONFLOW_API_KEY，跳过AI生图")
             return None
 
+        deadline = deadline or Deadline()
         try:
             # 构建更详细的prompt
             prompt = self._enhance_prompt(keyword)
             print(f"🎨 AI生成图片: {keyword}")
 
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-
-            payload = {
-                "model": self.model,
-                "prompt": prompt,
-                "seed": random.randint(0, 9999999999)
-            }
-
-            # Qwen-Image-Edit 模型需要参考图片
-            if "Qwen-Image-Edit" in self.model or "Qwen/Qwen-Image" in self.model:
-                # 获取一张随机图片作为参考基础
-                ref_image_url = self._get_reference_image()
-                payload["image"] = ref_image_url
-                payload["cfg"] = 4.0
-                payload["num_inference_steps"] = 50
-            else:
-                # Kolors 等纯文生图模型
-                payload["image_size"] = "1024x1024"
-                payload["num_inference_steps"] = 20
-                payload["guidance_scale"] = 7.5
-
-            response = requests.post(self.api_url, headers=headers, json=payload, timeout=120)
-            response.raise_for_status()
-
-            result = response.json()
-            if result.get('images') and len(result['images']) > 0:
-                image_url = result['images'][0]['url']
-                return self._download_image(image_url, f"ai_{index}_{hashlib.md5(keyword.encode()).hexdigest()[:8]}.jpg")
-
+            models = [self.model] + [m for m in self.fallback_models if m != self.model]
+            attempts = [(m, partial(self._request_image, m, prompt)) for m in models]
+            model, image_url = hedged_call(attempts, cap=120, default_delay=45, deadline=deadline)
+            if image_url:
+                batch = batch or uuid.uuid4().hex[:12]
+                filename = f"ai_{batch}_{index}.jpg"
+                image_path = self._download_image(image_url, filename, timeout=deadline.timeout(30))
+                if image_path:
+                    self.image_meta[image_path] = {"source": "ai", "model": model, "keyword": keyword}
+                return image_path
+
+        except DeadlineExceeded as e:
+            print(f"⚠️  AI生图超时: {e}")
         except requests.exceptions.HTTPError as e:
             print(f"⚠️  AI生图API错误: {e}")
             # 打印详细错误
@@ -86,6 +85,40 @@ class ImageFetcher:
             print(f"⚠️  AI生图失败: {e}")
         return None
 
+    def _request_image(self, model: str, prompt: str, session: requests.Session, timeout: float) -> str:
+        """调用一次图片生成接口，返回图片URL"""
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "seed": random.randint(0, 9999999999)
+        }
+
+        # Qwen-Image-Edit 模型需要参考图片
+        if "Qwen-Image-Edit" in model or "Qwen/Qwen-Image" in model:
+            # 获取一张随机图片作为参考基础
+            ref_image_url = self._get_reference_image()
+            payload["image"] = ref_image_url
+            payload["cfg"] = 4.0
+            payload["num_inference_steps"] = 50
+        else:
+            # Kolors 等纯文生图模型
+            payload["image_size"] = "1024x1024"
+            payload["num_inference_steps"] = 20
+            payload["guidance_scale"] = 7.5
+
+        response = session.post(self.api_url, headers=headers, json=payload, timeout=timeout)
+        response.raise_for_status()
+
+        result = response.json()
+        if result.get('images') and len(result['images']) > 0:
+            return result['images'][0]['url']
+        return None
+
     def _enhance_prompt(self, keyword: str) -> str:
         """增强prompt以获得更好的图片效果"""
         # 添加通用的图片质量描述
@@ -106,33 +139,43 @@ class ImageFetcher:
         seed = random.randint(1, 1000)
         return f"https://picsum.photos/seed/{seed}/512/512"
 
-    def _download_image(self, url: str, filename: str) -> str:
+    def _save(self, filename: str, content: bytes) -> str:
+        """先写临时文件再改名，其他进程不会读到写了一半的图片"""
+        filepath = os.path.join(self.output_dir, filename)
+        tmp_path = f"{filepath}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, filepath)
+        return filepath
+
+    def _download_image(self, url: str, filename: str, timeout: float = 30) -> str:
         """从URL下载图片"""
         try:
-            response = requests.get(url, timeout=30)
+            response = requests.get(url, timeout=timeout)
             if response.status_code == 200:
-                filepath = os.path.join(self.output_dir, filename)
-                with open(filepath, 'wb') as f:
-                    f.write(response.content)
+                filepath = self._save(filename, response.content)
                 print(f"✅ 已生成图片: {filepath}")
                 return filepath
         except Exception as e:
             print(f"下载图片失败: {e}")
         return None
 
-    def _download_from_picsum(self, seed: int = None) -> str:
+    def _download_from_picsum(self, seed: int = None, timeout: float = 15, batch: str = None,
+                              deadline: Deadline = None) -> str:
         """从 Lorem Picsum 下载随机图片（备用方案）"""
         try:
+            if deadline is not None:
+                timeout = deadline.timeout(timeout)
             seed = seed or random.randint(1, 1000)
             url = f"https://picsum.photos/seed/{seed}/800/600"
-            response = requests.get(url, timeout=15, allow_redirects=True)
+            response = requests.get(url, timeout=timeout, allow_redirects=True)
             if response.status_code == 200 and len(response.content) > 1000:
-                filename = f"picsum_{seed}.jpg"
-                filepath = os.path.join(self.output_dir, filename)
-                with open(filepath, 'wb') as f:
-                    f.write(response.content)
+                filename = f"picsum_{batch or uuid.uuid4().hex[:12]}_{seed}.jpg"
+                filepath = self._save(filename, response.content)
                 print(f"已下载图片(Picsum备用)：seed={seed} -> {filepath}")
                 return filepath
+        except DeadlineExceeded as e:
+            print(f"⚠️  备用图片下载超时: {e}")
         except Exception as e:
             print(f"下载图片失败(Picsum): {e}")
         return None
@@ -145,9 +188,7 @@ class ImageFetcher:
                 if not filename:
                     filename = hashlib.md5(url.encode()).hexdigest() + ".jpg"
 
-                filepath = os.path.join(self.output_dir, filename)
-                with open(filepath, 'wb') as f:
-                    f.write(response.content)
+                filepath = self._save(filename, response.content)
 
                 print(f"已下载图片：{filepath}")
                 return filepath
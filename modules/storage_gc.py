@@ -0,0 +1,198 @@
+"""存储清理模块 - 按磁盘预算清理 images/ 和 output/ 中的旧文件"""
+import fnmatch
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+BASE_DIR = Path(__file__).parent.parent
+OUTPUT_DIR = BASE_DIR / "output"
+DEFAULT_ROOTS = [BASE_DIR / "images", OUTPUT_DIR]
+
+# 永不清理的文件（草稿数据库、耗时统计、占位文件）
+PROTECTED_NAMES = {".gitkeep", "drafts.db", "drafts.db-wal", "drafts.db-shm", "latency.json"}
+
+# output/ 中只清理可以重新生成的文件（截图、未完成的临时文件），
+# 旧版 draft_*.json 等用户数据一律保留
+OUTPUT_EVICTABLE = ("*screenshot.png", "*.tmp")
+
+
+class StorageGC:
+    """
+    磁盘预算清理器
+
+    策略：
+    1. 待发布草稿引用的图片永远保留；发布失败的草稿只保留 failed_max_age_days 天；
+       output/ 中只清理截图和临时文件
+    2. grace_minutes 内修改过的文件不清理（图片已下载但草稿尚未保存）
+    3. 超过 max_age_days 未使用的文件直接清理
+    4. 总占用超过预算时，按最近使用时间（LRU）从旧到新清理，直到回到预算内
+
+    删除分批进行，每批之间让出CPU，不会阻塞发布流程。
+    """
+
+    def __init__(self, roots: List[str] = None, budget_mb: float = None,
+                 max_age_days: float = None, batch_size: int = 20,
+                 batch_pause: float = 0.05, db_path: str = None,
+                 grace_minutes: float = None, failed_max_age_days: float = None):
+        self.roots = [Path(r) for r in (roots or DEFAULT_ROOTS)]
+        if budget_mb is None:
+            budget_mb = float(os.getenv('XHS_DISK_BUDGET_MB', '500'))
+        if max_age_days is None:
+            max_age_days = float(os.getenv('XHS_GC_MAX_AGE_DAYS', '7'))
+        if grace_minutes is None:
+            grace_minutes = float(os.getenv('XHS_GC_GRACE_MINUTES', '30'))
+        if failed_max_age_days is None:
+            failed_max_age_days = float(os.getenv('XHS_GC_FAILED_MAX_AGE_DAYS', '3'))
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.grace_seconds = grace_minutes * 60
+        self.failed_max_age_days = failed_max_age_days
+        self.max_age_seconds = max_age_days * 86400
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.db_path = db_path
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.last_report: Optional[Dict] = None
+
+    def _pinned_paths(self) -> set:
+        """从草稿库读取需要保留的图片"""
+        from draft_store import DraftStore
+
+        store = DraftStore(self.db_path)
+        try:
+            return store.pinned_paths(self.failed_max_age_days)
+        finally:
+            store.close()
+
+    def _scan(self) -> List[tuple]:
+        """扫描文件，返回 [(最近使用时间, 大小, 路径, 修改时间)]"""
+        entries = []
+        output_dir = OUTPUT_DIR.resolve()
+        for root in self.roots:
+            if not root.exists():
+                continue
+            for dirpath, _, filenames in os.walk(root):
+                current = Path(dirpath).resolve()
+                in_output = current == output_dir or output_dir in current.parents
+                for name in filenames:
+                    if name in PROTECTED_NAMES:
+                        continue
+                    if in_output and not any(fnmatch.fnmatch(name, p) for p in OUTPUT_EVICTABLE):
+                        continue
+                    path = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    # 很多系统以 noatime/relatime 挂载，取 atime 与 mtime 的较大者
+                    entries.append((max(st.st_atime, st.st_mtime), st.st_size,
+                                    str(Path(path).resolve()), st.st_mtime))
+        return entries
+
+    def plan(self) -> Dict:
+        """计算本次需要清理的文件（不删除）"""
+        entries = self._scan()
+        pinned = self._pinned_paths()
+        total = sum(e[1] for e in entries)
+        now = time.time()
+
+        # 刚写入的文件可能还没有保存到草稿中，宽限期内不清理
+        candidates = sorted(e for e in entries
+                            if e[2] not in pinned and now - e[3] > self.grace_seconds)
+        victims = []
+        remaining = total
+        for last_used, size, path, _ in candidates:
+            expired = now - last_used > self.max_age_seconds
+            if not expired and remaining <= self.budget_bytes:
+                # 候选已按时间排序，之后的文件既未过期也无需腾空间
+                break
+            victims.append((path, size))
+            remaining -= size
+
+        return {
+            "total_bytes": total,
+            "pinned": len(pinned),
+            "victims": victims,
+        }
+
+    def run(self) -> Dict:
+        """执行一次清理，返回清理报告"""
+        plan = self.plan()
+        deleted = 0
+        reclaimed = 0
+
+        victims = plan["victims"]
+        for start in range(0, len(victims), self.batch_size):
+            if self._stop.is_set():
+                break
+            for path, size in victims[start:start + self.batch_size]:
+                try:
+                    os.remove(path)
+                    deleted += 1
+                    reclaimed += size
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"  ⚠️ 清理失败 {path}: {e}")
+            time.sleep(self.batch_pause)
+
+        report = {
+            "total_bytes": plan["total_bytes"],
+            "pinned": plan["pinned"],
+            "deleted": deleted,
+            "reclaimed_bytes": reclaimed,
+        }
+        self.last_report = report
+        return report
+
+    def start(self, interval: float = None, verbose: bool = True) -> threading.Thread:
+        """
+        在后台线程中运行清理
+
+        Args:
+            interval: 循环间隔（秒），为 None 时只运行一次
+            verbose: 是否在每次清理后打印报告
+        """
+        def loop():
+            while not self._stop.is_set():
+                try:
+                    report = self.run()
+                    if verbose and report["deleted"]:
+                        print(f"🧹 已清理 {report['deleted']} 个文件，释放 {format_bytes(report['reclaimed_bytes'])}")
+                except Exception as e:
+                    print(f"⚠️  存储清理失败: {e}")
+                if interval is None or self._stop.wait(interval):
+                    break
+
+        self._thread = threading.Thread(target=loop, name="storage-gc", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self, timeout: float = None):
+        """停止后台清理并等待当前批次结束"""
+        self._stop.set()
+        self.join(timeout)
+
+    def join(self, timeout: float = None):
+        """等待后台清理结束"""
+        if self._thread:
+            self._thread.join(timeout)
+
+
+def format_bytes(size: int) -> str:
+    """格式化字节数"""
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GB"
+
+
+if __name__ == "__main__":
+    gc = StorageGC()
+    report = gc.run()
+    print(f"占用: {format_bytes(report['total_bytes'])}（预算 {format_bytes(gc.budget_bytes)}）")
+    print(f"保留未发布草稿图片: {report['pinned']} 张")
+    print(f"已清理 {report['deleted']} 个文件，释放 {format_bytes(report['reclaimed_bytes'])}")
@@ -0,0 +1,375 @@
+"""多进程工作池 - 生成进程与发布进程分离，由监督进程分派任务"""
+import asyncio
+import multiprocessing
+import sys
+import time
+from collections import deque
+from multiprocessing.connection import wait
+from pathlib import Path
+from typing import Dict, List, Optional
+
+BASE_DIR = Path(__file__).parent.parent
+IMAGE_DIR = BASE_DIR / "images"
+
+# 发布进程退出码：浏览器未登录，重启也无济于事
+EXIT_NEED_LOGIN = 3
+# 发布进程退出码：浏览器重启失败，由监督进程重启发布进程
+EXIT_BROWSER = 4
+
+
+def profile_dir(index: int) -> Path:
+    """发布进程的浏览器数据目录（第一个进程沿用默认目录）"""
+    if index == 0:
+        return Path.home() / ".xhs_browser_data"
+    return Path.home() / f".xhs_browser_data_{index}"
+
+
+def generation_worker(name: str, conn):
+    """
+    生成进程：主题 -> 文案 + 图片 -> 草稿
+
+    从 conn 接收 (草稿ID, 主题)，完成后回复 ("done", 草稿ID, 状态, 剩余截止时间)，
+    状态为 ok / failed / expired。草稿ID由监督进程预先分配，崩溃后重试同一主题时
+    如果草稿已经保存则直接复用，不会产生重复草稿。
+    """
+    from content_generator import ContentGenerator
+    from draft_store import DraftStore
+    from hedging import Deadline, DeadlineExceeded
+    from image_fetcher import ImageFetcher
+
+    generator = ContentGenerator()
+    fetcher = ImageFetcher(str(IMAGE_DIR))
+    store = DraftStore()
+
+    try:
+        while True:
+            try:
+                job = conn.recv()
+            except EOFError:
+                break
+            if job is None:
+                break
+
+            draft_id, topic = job
+            status = "failed"
+            remaining = None
+            try:
+                deadline = Deadline.from_env()
+                if store.get(draft_id) is not None:
+                    # 上次崩溃前已保存，直接复用
+                    status = "ok"
+                else:
+                    content = generator.search_and_generate(topic, deadline=deadline)
+                    keywords = content.get('image_keywords', [topic])
+                    images = fetcher.search_and_download(keywords, count=3, deadline=deadline)
+                    if deadline.expired():
+                        # 生成阶段已用完时间，不再进入发布队列
+                        status = "expired"
+                        print(f"[{name}] ⏰ 生成超时，跳过: {topic}")
+                    else:
+                        store.create(content, images, fetcher.image_meta, draft_id=draft_id)
+                        status = "ok"
+                        print(f"[{name}] 📄 草稿已生成: {draft_id} ({topic})")
+                    fetcher.image_meta.clear()
+                remaining = deadline.remaining()
+            except DeadlineExceeded:
+                status = "expired"
+                print(f"[{name}] ⏰ 生成超时，跳过: {topic}")
+            except Exception as e:
+                print(f"[{name}] ❌ 生成失败 {topic}: {e}")
+            conn.send(("done", draft_id, status, remaining))
+    finally:
+        store.close()
+
+
+def publisher_worker(name: str, index: int, headless: bool, conn):
+    """发布进程：复用同一个浏览器依次发布监督进程分派的草稿"""
+    sys.exit(asyncio.run(_publisher_loop(name, index, headless, conn)))
+
+
+async def _publisher_loop(name: str, index: int, headless: bool, conn) -> int:
+    from draft_store import DraftStore
+    from hedging import Deadline
+    from xhs_playwright import BrowserUnavailable, XHSPublisher, publish_draft
+
+    publisher = XHSPublisher(headless=headless, user_data_dir=str(profile_dir(index)))
+    store = DraftStore()
+    loop = asyncio.get_running_loop()
+
+    try:
+        await publisher.init_browser()
+        if not await publisher.check_login():
+            if headless:
+                print(f"[{name}] ❌ 浏览器未登录: {publisher.user_data_dir}")
+                print(f"[{name}]    请先使用 --show 运行一次并手动登录")
+                return EXIT_NEED_LOGIN
+            if not await publisher.wait_for_login(timeout=300):
+                return EXIT_NEED_LOGIN
+
+        while True:
+            try:
+                job = await loop.run_in_executor(None, conn.recv)
+            except EOFError:
+                break
+            if job is None:
+                break
+
+            draft_id, remaining = job
+            success = False
+            try:
+                # 截止时间从发布进程取到草稿时开始计算，不包括排队等待的时间
+                result = await publish_draft(
+                    draft_id,
+                    store=store,
+                    deadline=Deadline(remaining),
+                    publisher=publisher
+                )
+                success = result["success"]
+                if not success:
+                    print(f"[{name}] ⚠️  {draft_id}: {result['message']}")
+            except BrowserUnavailable as e:
+                # 草稿尚未发布，交还给监督进程重新分派，本进程退出后由监督进程重启
+                print(f"[{name}] ❌ {e}")
+                conn.send(("done", draft_id, "retry", None))
+                return EXIT_BROWSER
+            except Exception as e:
+                print(f"[{name}] ❌ 发布失败 {draft_id}: {e}")
+            conn.send(("done", draft_id, "published" if success else "failed", None))
+    finally:
+        await publisher.close()
+        store.close()
+
+    return 0
+
+
+class WorkerPool:
+    """
+    生成/发布工作池
+
+    - 监督进程持有主题队列和待发布队列，通过每个工作进程独立的管道分派任务，
+      工作进程之间不共享锁，任何一个进程被强制结束都不会卡住其他进程
+    - 待发布草稿达到 queue_depth 时不再分派新主题（背压）
+    - 工作进程崩溃后自动重启：生成任务重试一次（复用已保存的草稿）；
+      发布任务不会自动重试（避免重复发布），草稿标记为失败
+    - 发布进程的浏览器重启失败时，草稿尚未发布，重新排队后由重启的发布进程处理
+    """
+
+    def __init__(self, generators: int = 1, publishers: int = 1, queue_depth: int = None,
+                 headless: bool = True, max_restarts: int = 5):
+        self.generators = generators
+        self.publishers = publishers
+        self.queue_depth = queue_depth or publishers * 2
+        self.headless = headless
+        self.max_restarts = max_restarts
+
+        # 使用 spawn：父进程中有清理线程，fork 后状态不安全
+        self.mp = multiprocessing.get_context("spawn")
+        self.slots: Dict[str, dict] = {}
+
+    def _spawn(self, slot: dict):
+        parent_conn, child_conn = self.mp.Pipe()
+        if slot["kind"] == "gen":
+            target = generation_worker
+            args = (slot["name"], child_conn)
+        else:
+            target = publisher_worker
+            args = (slot["name"], slot["index"], self.headless, child_conn)
+        slot["process"] = self.mp.Process(target=target, args=args, name=slot["name"], daemon=True)
+        slot["process"].start()
+        # 关闭父进程中的子端，子进程退出后父端能读到 EOF
+        child_conn.close()
+        slot["conn"] = parent_conn
+        slot["job"] = None
+        slot["exiting"] = False
+
+    def _live(self, kind: str = None) -> List[dict]:
+        return [s for s in self.slots.values()
+                if not s["stopped"] and (kind is None or s["kind"] == kind)]
+
+    def _idle(self, kind: str) -> List[dict]:
+        return [s for s in self._live(kind) if s["job"] is None and not s["exiting"]]
+
+    @staticmethod
+    def _send(slot: dict, job) -> bool:
+        try:
+            slot["conn"].send(job)
+            return True
+        except (OSError, ValueError):
+            # 进程已退出，交给崩溃处理
+            return False
+
+    @staticmethod
+    def _recv_all(slot: dict) -> List[tuple]:
+        """读取工作进程已发出的全部消息"""
+        messages = []
+        try:
+            while slot["conn"].poll():
+                messages.append(slot["conn"].recv())
+        except (EOFError, OSError):
+            pass
+        except Exception as e:
+            # 进程在写消息时被结束，残缺的消息无法解析
+            print(f"⚠️  读取 {slot['name']} 消息失败: {e}")
+        return messages
+
+    def run(self, topics: List[str]) -> Dict:
+        """
+        处理一批主题，全部生成并发布后返回
+
+        Returns:
+            统计: {topics, generated, published, failed, expired}
+        """
+        from draft_store import DraftStore, STATUS_FAILED, new_draft_id
+        from storage_gc import StorageGC
+        from hedging import Deadline
+
+        # XHS_NOTE_DEADLINE 配置有误时立即报错，而不是每个主题都生成失败
+        Deadline.from_env()
+
+        stats = {"topics": len(topics), "generated": 0, "published": 0, "failed": 0, "expired": 0}
+        topic_backlog = deque((new_draft_id(), topic) for topic in topics)
+        draft_backlog: deque = deque()
+        retried = set()
+
+        for kind, count in (("gen", self.generators), ("pub", self.publishers)):
+            for i in range(count):
+                name = f"{kind}-{i}"
+                self.slots[name] = {"name": name, "kind": kind, "index": i, "process": None,
+                                    "conn": None, "job": None, "restarts": 0, "stopped": False}
+                self._spawn(self.slots[name])
+
+        # 长时间运行时按磁盘预算定期清理，待发布草稿的图片会被保留
+        gc = StorageGC()
+        gc.start(interval=600)
+        store = DraftStore()
+
+        def handle(slot: dict, message: tuple):
+            _, draft_id, status, remaining = message
+            job, slot["job"] = slot["job"], None
+            if status == "retry":
+                # 工作进程随后退出，不再给它分派任务
+                slot["exiting"] = True
+                draft_backlog.appendleft(job)
+            elif slot["kind"] == "gen":
+                if status == "ok":
+                    stats["generated"] += 1
+                    draft_backlog.append((draft_id, remaining))
+                else:
+                    stats[status] += 1
+            else:
+                stats[status] += 1
+
+        try:
+            while True:
+                busy = [s for s in self._live() if s["job"] is not None]
+                if not topic_backlog and not draft_backlog and not busy:
+                    break
+
+                # 分派任务：待发布草稿达到上限时暂停生成
+                for slot in self._idle("gen"):
+                    if topic_backlog and len(draft_backlog) < self.queue_depth:
+                        slot["job"] = topic_backlog.popleft()
+                        self._send(slot, slot["job"])
+                for slot in self._idle("pub"):
+                    if draft_backlog:
+                        slot["job"] = draft_backlog.popleft()
+                        self._send(slot, slot["job"])
+
+                # 等待任意工作进程回复
+                conns = {s["conn"]: s for s in self._live()}
+                for conn in wait(list(conns), timeout=0.5):
+                    slot = conns[conn]
+                    for message in self._recv_all(slot):
+                        handle(slot, message)
+
+                # 处理退出的工作进程（先读完它退出前发出的消息）
+                for slot in self._live():
+                    process = slot["process"]
+                    if process.is_alive():
+                        continue
+                    for message in self._recv_all(slot):
+                        handle(slot, message)
+                    slot["conn"].close()
+
+                    name = slot["name"]
+                    job = slot["job"]
+                    print(f"⚠️  工作进程 {name} 异常退出 (exitcode={process.exitcode})")
+                    if job is not None:
+                        if slot["kind"] == "gen" and job[0] not in retried:
+                            retried.add(job[0])
+                            topic_backlog.appendleft(job)
+                        elif slot["kind"] == "gen":
+                            stats["failed"] += 1
+                        else:
+                            store.set_status(job[0], STATUS_FAILED)
+                            stats["failed"] += 1
+
+                    if process.exitcode == EXIT_NEED_LOGIN or slot["restarts"] >= self.max_restarts:
+                        slot["stopped"] = True
+                        slot["job"] = None
+                        print(f"❌ 工作进程 {name} 不再重启")
+                    else:
+                        slot["restarts"] += 1
+                        print(f"🔁 重启工作进程 {name}（第 {slot['restarts']} 次）")
+                        self._spawn(slot)
+
+                # 某一侧已无可用进程，剩余任务无法完成
+                if not self._live("gen") and topic_backlog:
+                    print("❌ 没有可用的生成进程，停止工作池")
+                    break
+                if not self._live("pub") and draft_backlog:
+                    print("❌ 没有可用的发布进程，停止工作池")
+                    break
+        finally:
+            # 通知工作进程退出，超时未退出的强制结束
+            for slot in self._live():
+                self._send(slot, None)
+            for slot in self.slots.values():
+                process: Optional[multiprocessing.Process] = slot["process"]
+                if process is None:
+                    continue
+                process.join(30)
+                if process.is_alive():
+                    process.terminate()
+                    process.join(5)
+            gc.stop(timeout=5)
+            store.close()
+
+        return stats
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="多进程批量生成并发布小红书笔记")
+    parser.add_argument("topics", help="主题文件，每行一个主题（- 表示从标准输入读取）")
+    parser.add_argument("--generators", "-g", type=int, default=2, help="生成进程数（默认2）")
+    parser.add_argument("--publishers", "-p", type=int, default=1, help="发布进程数（默认1）")
+    parser.add_argument("--queue-depth", "-q", type=int, default=None,
+                        help="待发布草稿上限（默认发布进程数×2）")
+    parser.add_argument("--show", action="store_true", help="显示浏览器窗口（首次登录时使用）")
+    args = parser.parse_args()
+
+    if args.topics == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(args.topics, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    topics = [line.strip() for line in lines if line.strip()]
+
+    if not topics:
+        print("❌ 主题列表为空")
+        sys.exit(1)
+
+    print(f"🚀 启动工作池: {args.generators} 个生成进程, {args.publishers} 个发布进程, {len(topics)} 个主题")
+    started = time.time()
+    pool = WorkerPool(
+        generators=args.generators,
+        publishers=args.publishers,
+        queue_depth=args.queue_depth,
+        headless=not args.show
+    )
+    stats = pool.run(topics)
+    print(f"\n✨ 完成，用时 {time.time() - started:.0f}s")
+    print(f"   生成 {stats['generated']} / 发布 {stats['published']} / "
+          f"失败 {stats['failed']} / 超时 {stats['expired']}")
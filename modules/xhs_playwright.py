@@ -1,21 +1,116 @@
 """小红书自动发布模块 - 使用Playwright自动化"""
-import json
 import os
+import shutil
 import time
 import asyncio
 from pathlib import Path
 from typing import List, Dict, Optional
 
+from hedging import DeadlineExceeded
+
+# 浏览器数据目录中可以安全删除的缓存（不包含 Cookies / Local Storage 等登录数据）
+PROFILE_CACHE_DIRS = [
+    "Default/Cache",
+    "Default/Code Cache",
+    "Default/GPUCache",
+    "Default/DawnCache",
+    "Default/Service Worker/CacheStorage",
+    "Default/Service Worker/ScriptCache",
+    "GrShaderCache",
+    "GraphiteDawnCache",
+    "ShaderCache",
+]
+
+# 判断登录 Cookie 的名称关键字
+LOGIN_COOKIE_HINTS = ("session", "sso", "token")
+
+# 浏览器重启失败时的启动尝试次数
+LAUNCH_ATTEMPTS = 3
+
+
+class BrowserUnavailable(RuntimeError):
+    """浏览器重启失败，当前发布器无法继续使用"""
+
+
+def process_tree_rss(pid: int = None) -> Optional[int]:
+    """统计指定进程所有子孙进程（Playwright驱动和Chromium）的内存占用（字节）"""
+    pid = pid or os.getpid()
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+
+    if psutil is not None:
+        total = 0
+        for child in psutil.Process(pid).children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+
+    # 没有 psutil 时读取 /proc（仅 Linux）
+    if not os.path.isdir("/proc/self"):
+        return None
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", 'r') as f:
+                # 进程名可能包含空格，从最后一个 ')' 之后解析
+                fields = f.read().rsplit(')', 1)[1].split()
+            children.setdefault(int(fields[1]), []).append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+
+    total = 0
+    stack = list(children.get(pid, []))
+    while stack:
+        child = stack.pop()
+        stack.extend(children.get(child, []))
+        try:
+            with open(f"/proc/{child}/status", 'r') as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+def _dir_size(path: Path) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
+
 
 class XHSPublisher:
     """使用Playwright自动发布到小红书"""
 
-    def __init__(self, headless: bool = False):
+    def __init__(self, headless: bool = False, user_data_dir: str = None):
         self.headless = headless
+        self.playwright = None
         self.browser = None
         self.context = None
         self.page = None
-        self.user_data_dir = Path.home() / ".xhs_browser_data"
+        # 同一个浏览器数据目录同时只能被一个浏览器使用，多进程发布时需分别指定
+        self.user_data_dir = Path(user_data_dir) if user_data_dir else Path.home() / ".xhs_browser_data"
+
+        # 长时间运行的资源控制：每发布 N 篇换新页面，内存超限或每 N 篇重启浏览器
+        self.page_recycle_every = int(os.getenv('XHS_PAGE_RECYCLE_EVERY', '10'))
+        self.browser_restart_every = int(os.getenv('XHS_BROWSER_RESTART_EVERY', '50'))
+        self.max_rss_bytes = int(float(os.getenv('XHS_BROWSER_MAX_RSS_MB', '1500')) * 1024 * 1024)
+        self.max_cache_bytes = int(float(os.getenv('XHS_PROFILE_CACHE_MAX_MB', '200')) * 1024 * 1024)
+        self.publish_count = 0
+        # 当前发布的截止时间（hedging.Deadline），由 publish() 设置
+        self._deadline = None
 
     async def init_browser(self):
         """初始化浏览器"""
@@ -23,6 +118,12 @@ class XHSPublisher:
 
         self.playwright = await async_playwright().start()
 
+        if self.profile_cache_size() > self.max_cache_bytes:
+            self.trim_profile_cache()
+        await self._launch()
+
+    async def _launch(self):
+        """启动持久化上下文"""
         # 使用持久化上下文保存登录状态
         self.context = await self.playwright.chromium.launch_persistent_context(
             user_data_dir=str(self.user_data_dir),
@@ -43,6 +144,118 @@ class XHSPublisher:
         if self.playwright:
             await self.playwright.stop()
 
+    def browser_rss(self) -> Optional[int]:
+        """浏览器相关进程的内存占用（字节），无法统计时返回 None"""
+        try:
+            return process_tree_rss()
+        except Exception:
+            return None
+
+    def profile_cache_size(self) -> int:
+        """浏览器数据目录中缓存的大小（字节）"""
+        return sum(_dir_size(self.user_data_dir / d) for d in PROFILE_CACHE_DIRS
+                   if (self.user_data_dir / d).exists())
+
+    def trim_profile_cache(self) -> int:
+        """删除浏览器缓存（需在浏览器关闭时调用），返回释放的字节数"""
+        reclaimed = 0
+        for d in PROFILE_CACHE_DIRS:
+            path = self.user_data_dir / d
+            if path.exists():
+                reclaimed += _dir_size(path)
+                shutil.rmtree(path, ignore_errors=True)
+        if reclaimed:
+            print(f"🧹 已清理浏览器缓存 {reclaimed / 1024 / 1024:.1f}MB")
+        return reclaimed
+
+    async def has_login_cookies(self) -> bool:
+        """检查持久化上下文中是否仍有登录 Cookie（不访问页面）"""
+        cookies = await self.context.cookies("https://creator.xiaohongshu.com")
+        return any(hint in c["name"].lower() for c in cookies for hint in LOGIN_COOKIE_HINTS)
+
+    async def recycle_page(self):
+        """关闭当前页面并打开新页面，释放渲染进程内存；打开失败时改为重启浏览器"""
+        old_page = self.page
+        try:
+            self.page = await self.context.new_page()
+        except Exception as e:
+            print(f"⚠️  打开新页面失败，改为重启浏览器: {e}")
+            await self.restart_browser()
+            return
+        try:
+            await old_page.close()
+        except Exception:
+            pass
+        print("♻️  已更换浏览器页面")
+
+    async def restart_browser(self):
+        """
+        重启浏览器上下文并清理缓存，登录状态保存在数据目录中不受影响
+
+        启动失败会重试，全部失败时抛出 BrowserUnavailable，不会留下已关闭的页面继续发布
+        """
+        try:
+            await self.context.close()
+        except Exception as e:
+            # 浏览器可能已经崩溃，关闭失败不影响重新启动
+            print(f"⚠️  关闭浏览器失败: {e}")
+        self.context = None
+        self.page = None
+        self.trim_profile_cache()
+
+        for attempt in range(1, LAUNCH_ATTEMPTS + 1):
+            try:
+                await self._launch()
+                break
+            except Exception as e:
+                print(f"⚠️  浏览器启动失败（第 {attempt} 次）: {e}")
+                if self.context:
+                    try:
+                        await self.context.close()
+                    except Exception:
+                        pass
+                    self.context = None
+                    self.page = None
+                if attempt == LAUNCH_ATTEMPTS:
+                    raise BrowserUnavailable(f"浏览器重启失败: {e}") from e
+                await asyncio.sleep(2 * attempt)
+
+        if not await self.has_login_cookies():
+            # 只有 Cookie 真的丢失时才需要重新登录（发布时检测到跳转登录页会等待登录）
+            print("⚠️  浏览器重启后登录 Cookie 丢失，下次发布时需要重新登录")
+        print("♻️  已重启浏览器")
+
+    async def _maintain(self):
+        """发布前检查资源占用，按需更换页面或重启浏览器"""
+        if self.publish_count == 0:
+            return
+
+        rss = self.browser_rss()
+        if rss is not None and rss > self.max_rss_bytes:
+            print(f"🧠 浏览器内存 {rss / 1024 / 1024:.0f}MB 超过上限，重启浏览器")
+            await self.restart_browser()
+        elif self.browser_restart_every and self.publish_count % self.browser_restart_every == 0:
+            await self.restart_browser()
+        elif self.page_recycle_every and self.publish_count % self.page_recycle_every == 0:
+            await self.recycle_page()
+
+    def _ms(self, ms: int) -> int:
+        """单步超时（毫秒），不超过截止时间的剩余时间"""
+        remaining = self._deadline.remaining() if self._deadline else None
+        if remaining is None:
+            return ms
+        return max(1, min(ms, int(remaining * 1000)))
+
+    async def _pause(self, seconds: float):
+        """等待页面响应，不超过截止时间的剩余时间"""
+        remaining = self._deadline.remaining() if self._deadline else None
+        await asyncio.sleep(seconds if remaining is None else min(seconds, remaining))
+
+    def _check_deadline(self):
+        """已超出截止时间则中止发布"""
+        if self._deadline is not None and self._deadline.expired():
+            raise DeadlineExceeded("已超出单篇笔记截止时间")
+
     async def check_login(self) -> bool:
         """检查是否已登录"""
         await self.page.goto("https://creator.xiaohongshu.com/publish/publish")
@@ -78,7 +291,8 @@ class XHSPublisher:
         print("❌ 登录超时")
         return False
 
-    async def publish(self, title: str, content: str, images: List[str], tags: List[str] = None) -> Dict:
+    async def publish(self, title: str, content: str, images: List[str], tags: List[str] = None,
+                      deadline=None) -> Dict:
         """
         发布笔记到小红书
 
@@ -87,31 +301,45 @@ class XHSPublisher:
             content: 笔记正文
             images: 图片路径列表
             tags: 话题标签列表
+            deadline: 单篇笔记截止时间（hedging.Deadline，可选）
 
         Returns:
             发布结果
         """
         result = {"success": False, "message": ""}
 
+        if deadline is not None and deadline.expired():
+            result["message"] = "已超出单篇笔记截止时间"
+            return result
+        self._deadline = deadline
+
+        # 回收失败时抛出 BrowserUnavailable，由调用方结束进程或重启发布器
+        await self._maintain()
+        self.publish_count += 1
+
         try:
             # 进入发布页面
-            await self.page.goto("https://creator.xiaohongshu.com/publish/publish")
-            await self.page.wait_for_load_state("networkidle")
-            await asyncio.sleep(3)
+            await self.page.goto("https://creator.xiaohongshu.com/publish/publish", timeout=self._ms(30000))
+            await self.page.wait_for_load_state("networkidle", timeout=self._ms(30000))
+            await self._pause(3)
 
             # 检查登录状态
             if "login" in self.page.url.lower():
-                logged_in = await self.wait_for_login()
+                login_timeout = 120
+                if deadline is not None and deadline.remaining() is not None:
+                    login_timeout = min(login_timeout, int(deadline.remaining()))
+                logged_in = await self.wait_for_login(timeout=login_timeout)
                 if not logged_in:
                     result["message"] = "登录失败或超时"
                     return result
 
                 # 重新进入发布页面
-                await self.page.goto("https://creator.xiaohongshu.com/publish/publish")
-                await self.page.wait_for_load_state("networkidle")
-                await asyncio.sleep(3)
+                await self.page.goto("https://creator.xiaohongshu.com/publish/publish", timeout=self._ms(30000))
+                await self.page.wait_for_load_state("networkidle", timeout=self._ms(30000))
+                await self._pause(3)
 
             print(f"📍 当前页面: {self.page.url}")
+            self._check_deadline()
 
             # 切换到"上传图文"标签（默认可能是视频）
             try:
@@ -125,23 +353,26 @@ class XHSPublisher:
                     }
                     return false;
                 }''')
-                await asyncio.sleep(2)
+                await self._pause(2)
             except:
                 pass
 
             # 上传图片
+            self._check_deadline()
             if images:
                 print(f"📷 上传 {len(images)} 张图片...")
                 try:
-                    file_input = await self.page.wait_for_selector('input[type="file"]', timeout=10000)
-                    abs_images = [str(Path(img).resolve()) for img in images if Path(img).exists()]
-                    if abs_images:
-                        await file_input.set_input_files(abs_images)
-                        print(f"✅ 已选择 {len(abs_images)} 张图片")
-                        # 等待图片上传和页面切换到编辑界面
-                        await asyncio.sleep(5)
+                    file_input = await self.page.wait_for_selector('input[type="file"]', timeout=self._ms(10000))
+                    abs_images = [str(Path(img).resolve()) for img in images]
+                    await file_input.set_input_files(abs_images)
+                    print(f"✅ 已选择 {len(abs_images)} 张图片")
+                    # 等待图片上传和页面切换到编辑界面
+                    await self._pause(5)
                 except Exception as e:
-                    print(f"⚠️  图片上传跳过: {e}")
+                    # 缺少任何一张图片都不发布，避免发出不完整的笔记
+                    print(f"❌ 图片上传失败: {e}")
+                    result["message"] = f"图片上传失败: {e}"
+                    return result
             else:
                 # 无图片时需要先上传一张占位图才能进入编辑界面
                 print("⚠️  没有图片，小红书图文笔记需要至少一张图片")
@@ -149,14 +380,15 @@ class XHSPublisher:
                 return result
 
             # 等待编辑界面加载
-            await asyncio.sleep(3)
+            await self._pause(3)
 
             # 填写标题 - 使用小红书实际的选择器
+            self._check_deadline()
             print("📝 填写标题...")
             try:
                 title_input = await self.page.wait_for_selector(
                     'input[placeholder*="标题"]',
-                    timeout=10000
+                    timeout=self._ms(10000)
                 )
                 if title_input:
                     await title_input.click()
@@ -203,7 +435,7 @@ class XHSPublisher:
                 try:
                     content_input = await self.page.wait_for_selector(
                         '.ProseMirror[contenteditable="true"]',
-                        timeout=5000
+                        timeout=self._ms(5000)
                     )
                     if content_input:
                         await content_input.click()
@@ -212,15 +444,16 @@ class XHSPublisher:
                 except:
                     pass
 
-            await asyncio.sleep(2)
+            await self._pause(2)
 
-            # 点击发布按钮
+            # 点击发布按钮（之后不再检查截止时间，已点击的笔记等待发布完成）
+            self._check_deadline()
             print("🚀 准备发布...")
             try:
                 # 使用文本选择器找到发布按钮
                 publish_btn = await self.page.wait_for_selector(
                     'button:has-text("发布")',
-                    timeout=10000
+                    timeout=self._ms(10000)
                 )
                 if publish_btn:
                     is_enabled = await publish_btn.is_enabled()
@@ -246,8 +479,14 @@ class XHSPublisher:
                 await self.page.screenshot(path=screenshot_path)
                 print(f"📸 已保存截图: {screenshot_path}")
 
+        except DeadlineExceeded as e:
+            result["message"] = str(e)
+            print(f"⏰ 发布中止: {e}")
         except Exception as e:
             result["message"] = f"发布失败: {str(e)}"
+            if self._deadline is not None and self._deadline.expired():
+                # 页面操作的超时被截止时间缩短，按超时处理
+                result["message"] = "已超出单篇笔记截止时间"
             print(f"❌ 发布失败: {e}")
             try:
                 screenshot_path = str(Path(__file__).parent.parent / "output" / "error_screenshot.png")
@@ -259,70 +498,154 @@ class XHSPublisher:
         return result
 
 
-async def publish_note(draft_path: str, image_folder: str, headless: bool = False) -> Dict:
+async def publish_note(draft_path: str, images: List[str], headless: bool = False) -> Dict:
     """
-    发布笔记的便捷函数
+    发布旧版JSON草稿的便捷函数
+
+    旧版草稿没有图片清单，需要明确指定要发布的图片；草稿先导入 DraftStore，
+    再按清单发布，不会使用图片文件夹中的其他图片。
 
     Args:
         draft_path: 草稿JSON文件路径
-        image_folder: 图片文件夹路径
+        images: 图片路径列表（按发布顺序）
+        headless: 是否无头模式
+
+    Returns:
+        发布结果
+    """
+    from draft_store import DraftStore
+
+    store = DraftStore()
+    try:
+        draft_id = store.import_json(draft_path, images)
+        print(f"📄 已导入草稿: {draft_id}")
+        return await publish_draft(draft_id, headless, store=store)
+    finally:
+        store.close()
+
+
+async def publish_draft(draft_id: str, headless: bool = False, store=None, deadline=None,
+                        publisher: XHSPublisher = None) -> Dict:
+    """
+    按草稿清单发布笔记
+
+    Args:
+        draft_id: DraftStore 中的草稿ID
         headless: 是否无头模式
+        store: 已打开的 DraftStore（可选）
+        deadline: 单篇笔记截止时间（hedging.Deadline，可选）
+        publisher: 已初始化的 XHSPublisher（可选，传入时复用浏览器且不关闭）
 
     Returns:
         发布结果
     """
-    # 加载草稿
-    with open(draft_path, 'r', encoding='utf-8') as f:
-        draft = json.load(f)
+    from draft_store import DraftStore, STATUS_FAILED, STATUS_PUBLISHED, verify_images
+
+    own_store = store is None
+    store = store or DraftStore()
+    try:
+        draft = store.get(draft_id)
+        if draft is None:
+            return {"success": False, "message": f"草稿不存在: {draft_id}"}
+
+        # 只上传清单中且与记录一致的图片，文件被覆盖或丢失时不发布
+        problems = verify_images(draft['images'])
+        if problems:
+            for problem in problems:
+                print(f"❌ {problem}")
+            store.set_status(draft_id, STATUS_FAILED)
+            return {"success": False, "message": f"草稿图片与清单不一致: {problems[0]}"}
+
+        images = [img['path'] for img in draft['images']]
+        result = await _publish_loaded(draft, images, headless, deadline, publisher)
+        store.set_status(draft_id, STATUS_PUBLISHED if result["success"] else STATUS_FAILED)
+        return result
+    finally:
+        if own_store:
+            store.close()
 
+
+async def _publish_loaded(draft: dict, images: List[str], headless: bool, deadline=None,
+                          publisher: XHSPublisher = None) -> Dict:
+    """发布已加载的草稿"""
     title = draft.get("title", "")
     content = draft.get("content", "")
     tags = draft.get("tags", [])
 
-    # 获取图片列表
-    images = []
-    img_dir = Path(image_folder)
-    if img_dir.exists():
-        images = list(img_dir.glob("*.jpg")) + list(img_dir.glob("*.png"))
-        images = [str(p) for p in images]
-
     print(f"\n📋 发布内容预览:")
     print(f"标题: {title}")
     print(f"正文: {content[:100]}...")
     print(f"标签: {', '.join(tags)}")
     print(f"图片: {len(images)} 张\n")
 
+    if publisher is not None:
+        return await publisher.publish(title, content, images, tags, deadline=deadline)
+
     # 初始化发布器
     publisher = XHSPublisher(headless=headless)
 
     try:
         await publisher.init_browser()
-        result = await publisher.publish(title, content, images, tags)
+        result = await publisher.publish(title, content, images, tags, deadline=deadline)
     finally:
         await publisher.close()
 
     return result
 
 
-def run_publish(draft_path: str, image_folder: str, headless: bool = False) -> Dict:
+def run_publish(draft_path: str, images: List[str], headless: bool = False) -> Dict:
     """同步版本的发布函数"""
-    return asyncio.run(publish_note(draft_path, image_folder, headless))
+    return asyncio.run(publish_note(draft_path, images, headless))
+
+
+async def _attach_and_publish(draft_id: str, images: List[str]) -> Dict:
+    """给只有文案的草稿补充图片后发布"""
+    from draft_store import DraftStore
+
+    store = DraftStore()
+    try:
+        draft = store.get(draft_id)
+        if draft is None:
+            return {"success": False, "message": f"草稿不存在: {draft_id}"}
+        if draft['images']:
+            return {"success": False, "message": f"草稿已有 {len(draft['images'])} 张图片，不能再追加"}
+        store.add_images(draft_id, images)
+        return await publish_draft(draft_id, store=store)
+    finally:
+        store.close()
 
 
 if __name__ == "__main__":
     import sys
 
-    if len(sys.argv) < 3:
-        print("用法: python xhs_playwright.py <draft_json> <image_folder>")
-        print("示例: python xhs_playwright.py ../output/draft_xxx.json ../images")
+    if len(sys.argv) < 2:
+        print("用法: python xhs_playwright.py <draft_id> [图片 ...]")
+        print("      python xhs_playwright.py <draft_json> <图片> [图片 ...]")
+        print("示例: python xhs_playwright.py 20250101_120000_a1b2c3")
+        print("      python xhs_playwright.py 20250101_120000_a1b2c3 ../images/a.jpg ../images/b.jpg")
+        print("      python xhs_playwright.py ../output/draft_xxx.json ../images/a.jpg")
         sys.exit(1)
 
     draft_path = sys.argv[1]
-    image_folder = sys.argv[2]
+    images = sys.argv[2:]
 
-    if not Path(draft_path).exists():
-        print(f"❌ 草稿文件不存在: {draft_path}")
+    missing = [img for img in images if not Path(img).is_file()]
+    if missing:
+        print(f"❌ 图片不存在: {', '.join(missing)}")
         sys.exit(1)
 
-    result = run_publish(draft_path, image_folder)
+    if draft_path.endswith(".json"):
+        if not images:
+            print("❌ 旧版JSON草稿需要指定要发布的图片")
+            sys.exit(1)
+        if not Path(draft_path).exists():
+            print(f"❌ 草稿文件不存在: {draft_path}")
+            sys.exit(1)
+        result = run_publish(draft_path, images)
+    elif images:
+        # 只生成了文案的草稿（content_generator.py），发布时补充图片
+        result = asyncio.run(_attach_and_publish(draft_path, images))
+    else:
+        result = asyncio.run(publish_draft(draft_path))
     print(f"\n发布结果: {result}")
+    sys.exit(0 if result["success"] else 1)
@@ -32,8 +32,9 @@ echo "1. 完整工作流（生成+发布）"
 echo "2. 仅生成文案"
 echo "3. 仅下载图片"
 echo "4. 仅发布（使用已有草稿）"
+echo "5. 批量模式（多进程生成+发布）"
 echo ""
-read -p "请选择 (1-4): " choice
+read -p "请选择 (1-5): " choice
 
 case $choice in
     1)
@@ -49,9 +50,17 @@ case $choice in
         cd modules && python3 image_fetcher.py
         ;;
     4)
-        read -p "请输入草稿文件路径: " draft
+        read -p "请输入草稿ID（或旧版JSON草稿路径）: " draft
+        read -p "补充图片路径（空格分隔，草稿已有图片时直接回车）: " images
         echo "启动Playwright发布..."
-        cd modules && python3 xhs_playwright.py "$draft" ../images/
+        cd modules && python3 xhs_playwright.py "$draft" $images
+        ;;
+    5)
+        read -p "请输入主题文件路径（每行一个主题）: " topics
+        read -p "生成进程数 [2]: " generators
+        read -p "发布进程数 [1]: " publishers
+        echo "启动工作池..."
+        python3 modules/worker_pool.py "$topics" -g "${generators:-2}" -p "${publishers:-1}"
         ;;
     *)
         echo "无效选择"
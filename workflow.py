@@ -7,7 +7,6 @@
 import sys
 import os
 import asyncio
-from datetime import datetime
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent / 'modules'))
@@ -15,7 +14,9 @@ sys.path.insert(0, str(Path(__file__).parent / 'modules'))
 from content_generator import ContentGenerator
 from image_fetcher import ImageFetcher
 from xhs_playwright import XHSPublisher
-import glob
+from draft_store import DraftStore, STATUS_FAILED, STATUS_PUBLISHED, format_draft
+from storage_gc import StorageGC, format_bytes
+from hedging import Deadline, DeadlineExceeded
 
 
 def main():
@@ -25,6 +26,10 @@ def main():
     print("📌 使用硅基流动API生成内容 + Playwright自动发布")
     print("=" * 60)
 
+    # 后台按磁盘预算清理旧文件（未发布草稿的图片会被保留）
+    gc = StorageGC()
+    gc.start(verbose=False)
+
     topic = input("\n💡 请输入你的想法或主题: ").strip()
 
     if not topic:
@@ -33,16 +38,18 @@ def main():
 
     print(f"\n✅ 收到主题: {topic}\n")
 
+    # 单篇笔记截止时间（XHS_NOTE_DEADLINE），覆盖生成和发布各阶段；
+    # 等待用户输入和手动登录的时间不计入
+    deadline = Deadline.from_env()
+
     # 步骤1: 生成文案
     print("📝 步骤1: 生成文案...")
     generator = ContentGenerator()
-    content = generator.search_and_generate(topic)
-
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    draft_filename = f"draft_{timestamp}.json"
-    draft_path = Path(__file__).parent / "output" / draft_filename
-
-    generator.save_draft(content, str(draft_path))
+    try:
+        content = generator.search_and_generate(topic, deadline=deadline)
+    except DeadlineExceeded:
+        print(f"⏰ 文案生成超时：已超出单篇笔记截止时间（XHS_NOTE_DEADLINE={os.getenv('XHS_NOTE_DEADLINE')}秒）")
+        return
 
     print(f"\n📄 文案预览:")
     print(f"标题: {content['title']}")
@@ -54,13 +61,19 @@ def main():
     image_keywords = content.get('image_keywords', [topic])
     image_dir = Path(__file__).parent / "images"
     fetcher = ImageFetcher(str(image_dir))
-    images = fetcher.search_and_download(image_keywords, count=3)
+    images = fetcher.search_and_download(image_keywords, count=3, deadline=deadline)
 
     if not images:
         print("⚠️  未能下载图片，将继续发布流程（无图片）")
     else:
         print(f"\n✅ 已下载 {len(images)} 张图片")
 
+    # 保存草稿包（文案 + 图片清单）
+    store = DraftStore()
+    draft_id = store.create(content, images, fetcher.image_meta)
+    images = [img['path'] for img in store.get_images(draft_id)]
+    print(f"📄 草稿已保存: {draft_id}")
+
     # 步骤3: 询问是否自动发布
     print(f"\n" + "=" * 60)
     print("🚀 步骤3: 发布到小红书")
@@ -70,53 +83,41 @@ def main():
     print("  1. 自动发布（使用Playwright自动化）")
     print("  2. 仅生成内容（手动复制发布）")
 
+    deadline.pause()
     choice = input("\n请输入选项 [1/2]: ").strip()
+    deadline.resume()
 
     if choice == "1":
         # 自动发布
         print("\n🚀 启动自动发布...")
-        asyncio.run(auto_publish(content, images))
-        
-        # 清理本地生成的文件
-        cleanup_local_files(str(draft_path), images)
+        result = asyncio.run(auto_publish(content, images, deadline))
+        published = bool(result and result['success'])
+        store.set_status(draft_id, STATUS_PUBLISHED if published else STATUS_FAILED)
     else:
-        # 仅生成内容
-        print(f"\n📁 草稿文件已保存: {draft_path}")
-        print(f"📁 图片文件夹: {image_dir}")
+        # 仅生成内容：打印完整草稿供手动复制
+        print("\n" + "-" * 60)
+        print(format_draft(store.get(draft_id)))
+        print("-" * 60)
+        print(f"\n📁 草稿已保存: {draft_id}（数据库: {store.db_path}）")
+        print(f"💡 再次查看: cd modules && python draft_store.py {draft_id}")
+        print(f"💡 稍后发布: cd modules && python xhs_playwright.py {draft_id}")
         print("\n💡 请手动复制内容到小红书创作中心发布:")
         print(f"   https://creator.xiaohongshu.com/publish/publish")
 
+    store.close()
+
+    gc.join()
+    if gc.last_report and gc.last_report['deleted']:
+        print(f"🧹 存储清理: 释放 {format_bytes(gc.last_report['reclaimed_bytes'])}")
+
     print(f"\n" + "=" * 60)
     print("✨ 工作流完成!")
     print("=" * 60)
 
 
-def cleanup_local_files(draft_path: str, images: list):
-    """清理本地生成的文件"""
-    print("\n🧹 清理本地文件...")
-    
-    # 删除草稿文件
-    try:
-        if os.path.exists(draft_path):
-            os.remove(draft_path)
-            print(f"  已删除草稿: {draft_path}")
-    except Exception as e:
-        print(f"  ⚠️ 删除草稿失败: {e}")
-    
-    # 删除图片文件
-    for img_path in images:
-        try:
-            if os.path.exists(img_path):
-                os.remove(img_path)
-                print(f"  已删除图片: {img_path}")
-        except Exception as e:
-            print(f"  ⚠️ 删除图片失败: {e}")
-    
-    print("✅ 本地文件清理完成")
-
-
-async def auto_publish(content: dict, images: list):
-    """自动发布到小红书"""
+async def auto_publish(content: dict, images: list, deadline: Deadline = None) -> dict:
+    """自动发布到小红书，返回发布结果（登录失败时返回 None）"""
+    deadline = deadline or Deadline()
     publisher = XHSPublisher(headless=False)
 
     try:
@@ -127,17 +128,20 @@ async def auto_publish(content: dict, images: list):
         logged_in = await publisher.check_login()
         if not logged_in:
             print("\n⚠️  需要登录小红书账号")
+            deadline.pause()
             logged_in = await publisher.wait_for_login(timeout=120)
+            deadline.resume()
             if not logged_in:
                 print("❌ 登录超时，请重试")
-                return
+                return None
 
         # 发布笔记
         result = await publisher.publish(
             title=content['title'],
             content=content['content'],
             images=images,
-            tags=content.get('tags', [])
+            tags=content.get('tags', []),
+            deadline=deadline
         )
 
         if result['success']:
@@ -145,6 +149,8 @@ async def auto_publish(content: dict, images: list):
         else:
             print(f"\n⚠️  {result['message']}")
 
+        return result
+
     finally:
         await publisher.close()
 
@@ -158,3 +164,4 @@ if __name__ == "__main__":
         print(f"\n❌ 错误: {e}")
         import traceback
         traceback.print_exc()
+        sys.exit(1)